@@ -0,0 +1,924 @@
+"""
+Núcleo de Cerebrito: normalización, análisis de llamadas y generación de PDF.
+No depende de Streamlit para poder usarse desde los procesos del servicio de trabajos.
+"""
+import pandas as pd
+import numpy as np
+from collections import Counter
+import matplotlib.pyplot as plt
+from io import BytesIO
+import hashlib
+from datetime import datetime
+import itertools
+import re
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak, Image
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from openpyxl import load_workbook
+
+# intentamos PyPDF2 para concatenar PDFs (si está disponible)
+try:
+    from PyPDF2 import PdfReader, PdfWriter
+    _HAVE_PYPDF = True
+except Exception:
+    _HAVE_PYPDF = False
+
+def _ensure_pdf_links_new_window(pdf_bytes):
+    """
+    Post-process PDF bytes and set /NewWindow true on any URI action annotations.
+    Returns modified bytes (or original if PyPDF2 not available or error).
+    """
+    if not _HAVE_PYPDF:
+        return pdf_bytes
+    try:
+        from PyPDF2 import PdfReader, PdfWriter
+        reader = PdfReader(BytesIO(pdf_bytes))
+        for page in reader.pages:
+            annots = page.get('/Annots')
+            if annots is None:
+                continue
+            for a in annots:
+                try:
+                    obj = a.get_object()
+                    if obj is None:
+                        continue
+                    A = obj.get('/A')
+                    if A is None:
+                        continue
+                    # If it's a URI action, set NewWindow = True
+                    if A.get('/S') == '/URI' or A.get('/URI') is not None:
+                        from PyPDF2.generic import NameObject
+                        A.update({NameObject('/NewWindow'): True})
+                except Exception:
+                    # ignore individual annotation errors
+                    continue
+        writer = PdfWriter()
+        for p in reader.pages:
+            writer.add_page(p)
+        out = BytesIO()
+        writer.write(out)
+        return out.getvalue()
+    except Exception:
+        return pdf_bytes
+
+# -------------------------------- utilidades ---------------------------------
+
+PALETA = ["#1f77b4", "#2ca02c", "#ff7f0e", "#9467bd", "#8c564b", "#17becf", "#d62728", "#7f7f7f", "#bcbd22", "#aec7e8"]
+
+def convertir_a_decimal(valor):
+    if pd.isna(valor):
+        return None
+    s = str(valor).strip()
+    s = s.replace(',', '.')
+    if re.match(r"^-?\d+\.\d+$", s):
+        return float(s)
+    m = re.search(r"(\d{1,3})[^\d]+(\d{1,2})[^\d]+(\d{1,2}(?:\.\d+)?)\s*([NnSsEeWw])?", s)
+    if m:
+        g, mnt, sec, hemi = m.groups()
+        dec = float(g) + float(mnt)/60.0 + float(sec)/3600.0
+        if hemi and hemi.upper() in ('S','W'):
+            dec = -dec
+        return dec
+    m2 = re.search(r"(\d{1,3})[^\d]+(\d{1,2}(?:\.\d+)?)\s*([NnSsEeWw])", s)
+    if m2:
+        g, mnt, hemi = m2.groups()
+        dec = float(g) + float(mnt)/60.0
+        if hemi and hemi.upper() in ('S','W'):
+            dec = -dec
+        return dec
+    if re.match(r"^-?\d+$", s):
+        return float(s)
+    return None
+
+def limpiar_numero(num):
+    if pd.isna(num):
+        return None
+    num = ''.join(filter(str.isdigit, str(num)))
+    if len(num) == 10:
+        return num
+    if len(num) > 10:
+        return num[-10:]
+    return None
+
+def generar_grafica(data, titulo):
+    fig, ax = plt.subplots(figsize=(6, 4))
+    numeros = [str(x[0]) for x in data]
+    frecs = [x[1] for x in data]
+    colores = list(itertools.islice(itertools.cycle(PALETA), len(numeros)))
+    barras = ax.barh(numeros, frecs, color=colores)
+    ax.set_title(titulo)
+    ax.invert_yaxis()
+    for barra, f in zip(barras, frecs):
+        ax.text(barra.get_width() + 0.5, barra.get_y() + barra.get_height()/2, str(f), va='center')
+    plt.tight_layout()
+    return fig
+
+def parsear_fecha_hora(df, fecha_col, hora_col):
+    # Serie datetime (NaT si no se puede interpretar) o None si no hay columna de fecha
+    if fecha_col is None:
+        return None
+    try:
+        if hora_col is not None:
+            return pd.to_datetime(df[fecha_col].astype(str) + ' ' + df[hora_col].astype(str), errors='coerce')
+        return pd.to_datetime(df[fecha_col], errors='coerce')
+    except Exception:
+        return None
+
+def _conteos_temporales(fechas, validos):
+    # Conteo por día de la semana y por fecha, solo de filas con número válido (`validos`: máscara por fila)
+    if fechas is None:
+        return Counter(), Counter()
+    validas = fechas[validos].dropna()
+    dias = Counter(validas.dt.day_name().value_counts().to_dict())
+    solo_fechas = Counter(validas.dt.strftime('%Y-%m-%d').value_counts().to_dict())
+    return dias, solo_fechas
+
+def _dia_fecha_top(dias, solo_fechas):
+    return {"dia_semana_top": dias.most_common(1)[0][0] if dias else None, "fecha_top": solo_fechas.most_common(1)[0][0] if solo_fechas else None}
+
+def construir_indice_numeros(nums):
+    """
+    Índice invertido en formato CSR a partir de la columna ya pasada por limpiar_numero (None para los
+    inválidos): catalogo (números distintos, ordenados), codigos (código de cada fila en el catálogo,
+    -1 si no es válido), orden (filas agrupadas por código, en orden de aparición) e inicio (donde
+    empieza cada código en `orden`; el último valor es el total). Son cuatro arreglos planos: se
+    construyen y serializan sin un objeto por número.
+    """
+    codigos, catalogo = pd.factorize(nums)
+    # limpiar_numero deja siempre 10 dígitos: ordenar como enteros da el mismo orden que el texto y es mucho más rápido
+    permutacion = np.argsort(np.asarray(catalogo, dtype=object).astype(np.int64))
+    rango = np.empty(len(permutacion) + 1, dtype=np.int32)
+    rango[permutacion] = np.arange(len(permutacion))
+    rango[-1] = -1
+    codigos = rango[codigos]
+    catalogo = np.asarray(catalogo, dtype=object)[permutacion]
+    orden = np.argsort(codigos, kind='stable')
+    # Los inválidos (-1) quedan al principio del orden: se saltan
+    n_invalidos = int(np.count_nonzero(codigos < 0))
+    inicio = np.concatenate(([0], np.bincount(codigos[codigos >= 0], minlength=len(catalogo)).cumsum())) + n_invalidos
+    return {
+        'catalogo': catalogo,
+        'codigos': codigos,
+        'orden': orden.astype(np.int32 if len(orden) < 2**31 else np.int64),
+        'inicio': inicio,
+    }
+
+def posiciones_numero(indice, numero):
+    # Filas (ordenadas) donde aparece `numero`: búsqueda binaria en el catálogo y un corte de `orden`
+    catalogo = indice['catalogo']
+    i = int(np.searchsorted(catalogo, numero)) if len(catalogo) else 0
+    if i == len(catalogo) or catalogo[i] != numero:
+        return np.empty(0, dtype=indice['orden'].dtype)
+    return indice['orden'][indice['inicio'][i]:indice['inicio'][i + 1]]
+
+def numeros_en(indice, posiciones=None):
+    # Números de las filas `posiciones` (todas si es None), con None para los inválidos
+    codigos = indice['codigos'] if posiciones is None else indice['codigos'][posiciones]
+    nums = np.full(len(codigos), None, dtype=object)
+    validos = codigos >= 0
+    nums[validos] = indice['catalogo'][codigos[validos]]
+    return nums
+
+def _conteo_numeros(indice):
+    # Counter número -> llamadas, insertado en orden de primera aparición (empates de most_common como antes)
+    inicio = indice['inicio']
+    if len(inicio) < 2:
+        return Counter()
+    conteo = np.diff(inicio)
+    por_aparicion = np.argsort(indice['orden'][inicio[:-1]], kind='stable')
+    return Counter(dict(zip(indice['catalogo'][por_aparicion].tolist(), conteo[por_aparicion].tolist())))
+
+def _columna_decimal(serie):
+    # convertir_a_decimal sobre valores únicos (las coordenadas se repiten mucho); NaN si no es válida
+    mapa = {v: convertir_a_decimal(v) for v in serie.dropna().unique()}
+    return np.array(serie.map(mapa).tolist(), dtype=float)
+
+def _sin_coordenadas():
+    return pd.Series([], index=pd.MultiIndex.from_arrays([[], [], []], names=['num', 'lat', 'lon']), dtype=np.int64)
+
+def _contar_coordenadas(nums, lat, lon):
+    # Serie (num, lat, lon) -> veces, ordenada, para todas las filas con número y coordenada válidos
+    tabla = pd.DataFrame({'num': nums, 'lat': lat, 'lon': lon}).dropna()
+    if tabla.empty:
+        return _sin_coordenadas()
+    return tabla.groupby(['num', 'lat', 'lon']).size().astype(np.int64)
+
+def _coordenadas_top(top, coords_num):
+    """
+    Coordenada más frecuente de cada número del top (empates: la menor lat/lon). `coords_num` es una
+    lista de series de _contar_coordenadas (una por archivo): solo se suman las filas de los números del top.
+    """
+    coords = {}
+    nums = [num for num, _ in top]
+    partes = [serie[serie.index.get_level_values('num').isin(nums)] for serie in coords_num]
+    partes = [parte for parte in partes if not parte.empty]
+    if not partes:
+        return coords
+    if len(partes) == 1:
+        sub = partes[0]
+    else:
+        # reset_index deja solo las filas del top (concatenar los MultiIndex arrastraría todos sus niveles)
+        sub = pd.concat([parte.reset_index(name='veces') for parte in partes]).groupby(['num', 'lat', 'lon'])['veces'].sum()
+    modal = sub.groupby(level='num').idxmax()
+    for num in nums:
+        if num in modal.index:
+            clave = modal[num]
+            coords[num] = {"lat": float(clave[1]), "lon": float(clave[2]), "count": int(sub[clave])}
+    return coords
+
+def analizar_segmento(df_proc, col_ent, col_sal, col_fecha=None, col_hora=None, col_lat=None, col_lon=None, nombre=None, progreso=None):
+    """
+    Procesa una sola vez un bloque de filas (un archivo): normaliza los números, construye los
+    índices invertidos y calcula los conteos parciales que fusionar_segmento acumula en el análisis.
+    `progreso(fraccion, mensaje)` es opcional y se llama entre etapas.
+    """
+    if progreso is None:
+        progreso = lambda fraccion, mensaje: None
+    progreso(0.0, 'Normalizando números')
+    nums_ent = np.array([limpiar_numero(x) for x in df_proc[col_ent]], dtype=object)
+    nums_sal = np.array([limpiar_numero(x) for x in df_proc[col_sal]], dtype=object)
+    indice_ent = construir_indice_numeros(nums_ent)
+    indice_sal = construir_indice_numeros(nums_sal)
+    progreso(0.4, 'Análisis temporal')
+    fechas = parsear_fecha_hora(df_proc, col_fecha, col_hora)
+    dias_ent, solo_fechas_ent = _conteos_temporales(fechas, indice_ent['codigos'] >= 0)
+    dias_sal, solo_fechas_sal = _conteos_temporales(fechas, indice_sal['codigos'] >= 0)
+    orden_ts = _orden_temporal(fechas)
+
+    lat = lon = None
+    coords_num_ent = coords_num_sal = _sin_coordenadas()
+    if col_lat is not None and col_lon is not None:
+        progreso(0.55, 'Coordenadas')
+        lat = _columna_decimal(df_proc[col_lat])
+        lon = _columna_decimal(df_proc[col_lon])
+        coords_num_ent = _contar_coordenadas(nums_ent, lat, lon)
+        coords_num_sal = _contar_coordenadas(nums_sal, lat, lon)
+
+    progreso(0.85, 'Conteos por número')
+    # Solo se conservan las columnas del análisis (las que muestra el detalle por número)
+    columnas = list(dict.fromkeys(c for c in (col_ent, col_sal, col_fecha, col_hora, col_lat, col_lon) if c is not None))
+    return {
+        'nombre': nombre,
+        'df': df_proc[columnas],
+        'fechas': fechas,
+        # Filas con fecha válida ordenadas por timestamp: el índice temporal del análisis solo las intercala
+        'orden_ts': orden_ts,
+        'lat': lat,
+        'lon': lon,
+        # Los números de cada fila viven en el índice (código + catálogo): no se guarda un str por fila
+        'indice_ent': indice_ent,
+        'indice_sal': indice_sal,
+        # Conteos parciales: se vacían al fusionar el segmento
+        'conteos': {
+            'cont_ent': _conteo_numeros(indice_ent),
+            'cont_sal': _conteo_numeros(indice_sal),
+            'dias_ent': dias_ent,
+            'dias_sal': dias_sal,
+            'fechas_ent': solo_fechas_ent,
+            'fechas_sal': solo_fechas_sal,
+            'coords_num_ent': coords_num_ent,
+            'coords_num_sal': coords_num_sal,
+        },
+    }
+
+def huella_archivo(datos):
+    # Identifica un archivo por su contenido (no por el nombre: el mismo export reenviado con otro nombre
+    # duplicaría todos los conteos) para no agregarlo dos veces al mismo análisis
+    return hashlib.sha256(datos).hexdigest()
+
+def nuevo_analisis(config):
+    # `config` guarda la selección de columnas para poder agregar archivos con el mismo formato
+    return {
+        'config': config,
+        'segmentos': [],
+        'n_filas': 0,
+        'cont_ent': Counter(),
+        'cont_sal': Counter(),
+        'dias_ent': Counter(),
+        'dias_sal': Counter(),
+        'fechas_ent': Counter(),
+        'fechas_sal': Counter(),
+        # Una serie (num, lat, lon) -> veces por archivo; se combinan solo para los números del top
+        'coords_num_ent': [],
+        'coords_num_sal': [],
+        'huellas': set(),
+    }
+
+def fusionar_segmento(estado, segmento, n=10, huella=None):
+    """
+    Acumula los conteos de un segmento en el análisis y recalcula el resumen (top, coordenadas
+    modales, días). Los conteos del segmento nuevo se suman a los acumulados sin volver a recorrer
+    los segmentos anteriores.
+    Con `huella` (ver huella_archivo) se rechaza con ValueError un archivo que ya fue agregado.
+    """
+    if huella is not None and huella in estado['huellas']:
+        raise ValueError(f'El contenido de {segmento["nombre"]} ya forma parte del análisis.')
+    conteos = segmento.pop('conteos')
+    for clave in ('cont_ent', 'cont_sal', 'dias_ent', 'dias_sal', 'fechas_ent', 'fechas_sal'):
+        estado[clave].update(conteos[clave])
+    for clave in ('coords_num_ent', 'coords_num_sal'):
+        estado[clave].append(conteos[clave])
+    estado['segmentos'].append(segmento)
+    if huella is not None:
+        estado['huellas'].add(huella)
+    # Si el índice temporal ya existe, se le intercalan las filas nuevas (sin reordenar las anteriores)
+    if estado.get('indice_temporal') is not None:
+        _extender_indice_temporal(estado['indice_temporal'], segmento, estado['n_filas'])
+    estado['n_filas'] += len(segmento['df'])
+    actualizar_resumen(estado, n=n)
+    return estado
+
+def actualizar_resumen(estado, n=10):
+    # Deriva del estado acumulado lo que muestran la UI y el PDF
+    top_ent = estado['cont_ent'].most_common(n)
+    top_sal = estado['cont_sal'].most_common(n)
+    estado.update({
+        'top_ent': top_ent,
+        'top_sal': top_sal,
+        'coords_ent': _coordenadas_top(top_ent, estado['coords_num_ent']),
+        'coords_sal': _coordenadas_top(top_sal, estado['coords_num_sal']),
+        'dia_ent': _dia_fecha_top(estado['dias_ent'], estado['fechas_ent']),
+        'dia_sal': _dia_fecha_top(estado['dias_sal'], estado['fechas_sal']),
+        'use_geo': estado['config'].get('use_geo', False),
+    })
+    return estado
+
+def obtener_detalle_numero(estado, numero):
+    """
+    Detalle de un número a partir de los índices invertidos de cada segmento (sin recorrer los archivos).
+    Retorna None si el número no aparece; si aparece, un dict con:
+      llamadas (DataFrame con columnas 'Archivo' y 'Rol': Entrante / Saliente / Ambos), contrapartes [(número, veces)],
+      por_hora (Serie 0-23 o None) y ubicaciones [((lat, lon), veces)].
+    """
+    partes = []
+    contrapartes = Counter()
+    horas = Counter()
+    hay_fechas = False
+    ubicaciones = Counter()
+    for seg in estado['segmentos']:
+        pos_ent = posiciones_numero(seg['indice_ent'], numero)
+        pos_sal = posiciones_numero(seg['indice_sal'], numero)
+        posiciones = np.union1d(pos_ent, pos_sal)
+        if posiciones.size == 0:
+            continue
+
+        llamadas = seg['df'].iloc[posiciones].copy()
+        como_ent = np.isin(posiciones, pos_ent)
+        como_sal = np.isin(posiciones, pos_sal)
+        # Una fila donde el número es origen y destino a la vez se marca 'Ambos'
+        llamadas.insert(0, 'Rol', np.where(como_ent & como_sal, 'Ambos', np.where(como_ent, 'Entrante', 'Saliente')))
+        llamadas.insert(0, 'Archivo', seg['nombre'])
+        partes.append(llamadas)
+
+        # Si el número llama, la contraparte es el destino de esa fila (y viceversa); el propio número no cuenta
+        contrapartes.update(x for x in numeros_en(seg['indice_sal'], pos_ent) if x and x != numero)
+        contrapartes.update(x for x in numeros_en(seg['indice_ent'], pos_sal) if x and x != numero)
+
+        if seg['fechas'] is not None:
+            hay_fechas = True
+            horas.update(seg['fechas'].iloc[posiciones].dropna().dt.hour.tolist())
+
+        if seg['lat'] is not None:
+            lat, lon = seg['lat'][posiciones], seg['lon'][posiciones]
+            validas = ~(np.isnan(lat) | np.isnan(lon))
+            ubicaciones.update(zip(lat[validas].tolist(), lon[validas].tolist()))
+
+    if not partes:
+        return None
+
+    return {
+        'llamadas': pd.concat(partes),
+        'contrapartes': contrapartes.most_common(),
+        'por_hora': pd.Series(horas, dtype='int64').reindex(range(24), fill_value=0) if hay_fechas else None,
+        'ubicaciones': ubicaciones.most_common(),
+    }
+
+def obtener_indice_temporal(estado):
+    """
+    Índice temporal del análisis (se construye al pedirlo la primera vez, se guarda en el estado y
+    fusionar_segmento lo extiende con cada archivo agregado). Retorna None si no hay fechas. Las filas
+    con fecha válida quedan ordenadas por timestamp y cada arreglo sigue ese orden:
+      ts (datetime64), hora (0-23), fila (posición en el orden de los archivos), cod_ent / cod_sal
+      (código en `catalogo`, -1 si el número no es válido; `claves` son los mismos números como
+      enteros), lat / lon (NaN sin coordenada, o None sin columnas geo), dias (días distintos) e inicio_dia (posición donde empieza cada día; el último
+      valor es el total).
+    Los filtros toman vistas [inicio:fin] de estos arreglos, sin recorrer ni copiar la tabla.
+    """
+    if estado.get('indice_temporal') is not None:
+        return estado['indice_temporal']
+    segmentos = estado['segmentos']
+    if all(seg['fechas'] is None for seg in segmentos):
+        return None
+
+    use_geo = estado['config'].get('use_geo')
+    vacio = np.zeros(0, dtype=np.float64) if use_geo else None
+    indice = {
+        'ts': np.zeros(0, dtype='datetime64[ns]'),
+        'hora': np.zeros(0, dtype=np.int8),
+        'fila': np.zeros(0, dtype=np.int64),
+        'cod_ent': np.zeros(0, dtype=np.int32),
+        'cod_sal': np.zeros(0, dtype=np.int32),
+        'catalogo': np.zeros(0, dtype=object),
+        'claves': np.zeros(0, dtype=np.int64),
+        'lat': vacio,
+        'lon': vacio,
+    }
+    desplazamiento = 0
+    for seg in segmentos:
+        _extender_indice_temporal(indice, seg, desplazamiento)
+        desplazamiento += len(seg['df'])
+    estado['indice_temporal'] = indice
+    return indice
+
+def _orden_temporal(fechas):
+    # Posiciones de las filas con fecha válida, ordenadas por timestamp (estable: empates en orden del archivo)
+    if fechas is None:
+        return None
+    ts = fechas.to_numpy(dtype='datetime64[ns]')
+    validas = np.flatnonzero(~np.isnat(ts))
+    return validas[np.argsort(ts[validas], kind='stable')]
+
+def _extender_indice_temporal(indice, segmento, desplazamiento):
+    """
+    Intercala en el índice temporal las filas con fecha de un segmento, cuyas filas empiezan en la
+    posición `desplazamiento` del análisis. Solo se ordena el segmento nuevo (orden_ts); sus filas se
+    ubican con búsqueda binaria sobre el ts ya ordenado, después de las existentes con el mismo
+    timestamp, así que el resultado es el de un ordenamiento estable de todos los archivos. Los
+    números nuevos se agregan al final del catálogo: los códigos existentes no cambian.
+    """
+    if segmento['fechas'] is not None:
+        orden = segmento['orden_ts']
+        ts_nuevo = segmento['fechas'].to_numpy(dtype='datetime64[ns]')[orden]
+
+        # Un solo catálogo para entrantes y salientes: los códigos de cada índice por número se traducen
+        # al catálogo común y los conteos se hacen con np.bincount. Las búsquedas usan los números como
+        # enteros (siempre 10 dígitos, ver construir_indice_numeros): `claves` va en paralelo al catálogo
+        claves_ent = segmento['indice_ent']['catalogo'].astype(np.int64)
+        claves_sal = segmento['indice_sal']['catalogo'].astype(np.int64)
+        propias, primera = np.unique(np.concatenate([claves_ent, claves_sal]), return_index=True)
+        claves = pd.Index(indice['claves'])
+        faltan = claves.get_indexer(propias) < 0
+        if faltan.any():
+            textos = np.concatenate([segmento['indice_ent']['catalogo'], segmento['indice_sal']['catalogo']])[primera[faltan]]
+            indice['catalogo'] = np.concatenate([indice['catalogo'], textos])
+            indice['claves'] = np.concatenate([indice['claves'], propias[faltan]])
+            claves = pd.Index(indice['claves'])
+
+        posiciones = np.searchsorted(indice['ts'], ts_nuevo, side='right')
+        nuevos_valores = {
+            'ts': ts_nuevo,
+            'hora': (ts_nuevo.astype('datetime64[h]').astype(np.int64) % 24).astype(np.int8),
+            'fila': desplazamiento + orden,
+            'cod_ent': _recodificar(segmento['indice_ent'], claves_ent, claves)[orden],
+            'cod_sal': _recodificar(segmento['indice_sal'], claves_sal, claves)[orden],
+        }
+        if indice['lat'] is not None:
+            nuevos_valores['lat'] = segmento['lat'][orden]
+            nuevos_valores['lon'] = segmento['lon'][orden]
+        for clave, valores in nuevos_valores.items():
+            indice[clave] = np.insert(indice[clave], posiciones, valores)
+
+    # ts ya está ordenado: los días empiezan donde cambia la fecha
+    ts = indice['ts']
+    dia = ts.astype('datetime64[D]')
+    inicio_dia = np.concatenate(([0], np.flatnonzero(dia[1:] != dia[:-1]) + 1)) if len(dia) else np.zeros(0, dtype=np.int64)
+    indice['dias'] = dia[inicio_dia]
+    indice['inicio_dia'] = np.append(inicio_dia, len(ts))
+    return indice
+
+def _recodificar(indice, claves_indice, claves):
+    # Códigos de un índice por número (cuyo catálogo son `claves_indice`) expresados en el catálogo común
+    # (`claves`, pd.Index), conservando -1 para los inválidos
+    mapa = np.append(claves.get_indexer(claves_indice), -1).astype(np.int32)
+    return mapa[indice['codigos']]
+
+def _marcar_codigos(seleccion, total):
+    # Tabla booleana código -> seleccionado (más rápida que np.isin sobre millones de filas); el -1 de
+    # los números inválidos cae en la última posición, por eso se combina siempre con la máscara de válidas
+    marca = np.zeros(total, dtype=bool)
+    marca[seleccion] = True
+    return marca
+
+def _top_codigos(conteo, n, codigos, validas, filas):
+    # Los n códigos con más llamadas, de mayor a menor. Como Counter.most_common sobre las llamadas
+    # filtradas (`validas`), los empates se resuelven por primera aparición en los archivos (`filas`);
+    # por eso entran todos los empatados con el n-ésimo antes de recortar.
+    candidatos = np.flatnonzero(conteo)
+    if candidatos.size == 0:
+        return candidatos
+    if candidatos.size > n:
+        umbral = np.partition(conteo[candidatos], candidatos.size - n)[candidatos.size - n]
+        candidatos = candidatos[conteo[candidatos] >= umbral]
+    sel = validas & _marcar_codigos(candidatos, len(conteo))[codigos]
+    primera = np.full(len(conteo), np.iinfo(np.int64).max)
+    np.minimum.at(primera, codigos[sel], filas[sel])
+    return candidatos[np.lexsort((primera[candidatos], -conteo[candidatos]))][:n]
+
+def _dia_fecha_top_rango(dias, por_dia):
+    # Equivalente a _dia_fecha_top a partir de conteos por día (dias: datetime64[D])
+    if por_dia.sum() == 0:
+        return {"dia_semana_top": None, "fecha_top": None}
+    semana = np.bincount((dias.astype(np.int64) + 3) % 7, weights=por_dia, minlength=7)  # 1970-01-01 fue jueves
+    nombres = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    return {"dia_semana_top": nombres[int(np.argmax(semana))], "fecha_top": str(dias[int(np.argmax(por_dia))])}
+
+def filtrar_por_tiempo(indice, desde=None, hasta=None, hora_desde=0, hora_hasta=23, n=10):
+    """
+    Resumen (top, días, coordenadas modales) solo de las llamadas entre los días `desde` y `hasta`
+    (inclusive) y con hora entre `hora_desde` y `hora_hasta` (si hora_desde > hora_hasta el rango
+    cruza la medianoche, p. ej. 22 a 5). El rango de días se resuelve con búsqueda binaria sobre los días
+    del índice y sus posiciones de inicio.
+    """
+    dias, inicio_dia = indice['dias'], indice['inicio_dia']
+    d0 = 0 if desde is None else int(np.searchsorted(dias, np.datetime64(desde, 'D'), side='left'))
+    d1 = len(dias) if hasta is None else int(np.searchsorted(dias, np.datetime64(hasta, 'D'), side='right'))
+    d1 = max(d0, d1)
+    ini, fin = inicio_dia[d0], inicio_dia[d1]
+
+    en_horario = None
+    if (hora_desde, hora_hasta) != (0, 23):
+        hora = indice['hora'][ini:fin]
+        if hora_desde <= hora_hasta:
+            en_horario = (hora >= hora_desde) & (hora <= hora_hasta)
+        else:
+            en_horario = (hora >= hora_desde) | (hora <= hora_hasta)
+
+    catalogo = indice['catalogo']
+    filas = indice['fila'][ini:fin]
+    resumen = {'n_llamadas': int(fin - ini) if en_horario is None else int(en_horario.sum())}
+    for rol in ('ent', 'sal'):
+        codigos = indice[f'cod_{rol}'][ini:fin]
+        validas = codigos >= 0
+        if en_horario is not None:
+            validas &= en_horario
+        conteo = np.bincount(codigos[validas], minlength=len(catalogo))
+        top_cod = _top_codigos(conteo, n, codigos, validas, filas)
+        top = [(catalogo[c], int(conteo[c])) for c in top_cod]
+
+        por_dia = np.add.reduceat(validas, inicio_dia[d0:d1] - ini, dtype=np.int64) if fin > ini else np.zeros(0, dtype=np.int64)
+        coords = {}
+        if indice['lat'] is not None and top:
+            sel = validas & _marcar_codigos(top_cod, len(catalogo))[codigos]
+            coords = _coordenadas_top(top, [_contar_coordenadas(catalogo[codigos[sel]], indice['lat'][ini:fin][sel], indice['lon'][ini:fin][sel])])
+        resumen[f'top_{rol}'] = top
+        resumen[f'coords_{rol}'] = coords
+        resumen[f'dia_{rol}'] = _dia_fecha_top_rango(dias[d0:d1], por_dia)
+    return resumen
+
+def leer_archivo(archivo, nombre=None):
+    # `nombre` permite leer desde una ruta o bytes (BytesIO) que no traen .name
+    nombre = nombre or archivo.name
+    if nombre.lower().endswith('.csv'):
+        return pd.read_csv(archivo, header=None, low_memory=False)
+    return pd.read_excel(archivo, header=None)
+
+def leer_vista_previa(archivo, filas=1000, nombre=None):
+    # Solo las primeras `filas` (el archivo completo se lee en el servicio de trabajos)
+    nombre = nombre or archivo.name
+    if nombre.lower().endswith('.csv'):
+        return pd.read_csv(archivo, header=None, nrows=filas, low_memory=False)
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        return pd.DataFrame(list(libro.worksheets[0].iter_rows(max_row=filas, values_only=True)))
+    finally:
+        libro.close()
+
+def detectar_columnas_coordenadas(df):
+    # Primer par de columnas numéricas con rangos válidos de latitud / longitud; (None, None) si no hay
+    candidates = []
+    for c in df.columns:
+        try:
+            series = pd.to_numeric(df[c], errors='coerce').dropna()
+            if not series.empty:
+                mn, mx = series.min(), series.max()
+                candidates.append((c, mn, mx))
+        except Exception:
+            continue
+    for a in candidates:
+        for b in candidates:
+            if a[0] == b[0]:
+                continue
+            if -90 <= a[1] <= 90 and -90 <= a[2] <= 90 and -180 <= b[1] <= 180 and -180 <= b[2] <= 180:
+                return a[0], b[0]
+    return None, None
+
+# ---------------- Google Maps URLs ----------------
+
+def _google_street_url(lat, lon):
+    return f"https://www.google.com/maps/@?api=1&map_action=pano&viewpoint={lat:.6f},{lon:.6f}"
+
+def _google_maps_search_url(lat, lon):
+    return f"https://www.google.com/maps/search/?api=1&query={lat:.6f},{lon:.6f}"
+
+def _google_maps_embed_url(lat, lon, zoom=17):
+    return f"https://www.google.com/maps?q={lat:.6f},{lon:.6f}&z={zoom}&output=embed"
+
+def _gmap_iframe_html(lat, lon, label, height=380):
+    embed = _google_maps_embed_url(lat, lon)
+    street = _google_street_url(lat, lon)
+    maps_link = _google_maps_search_url(lat, lon)
+    html = f"""
+<div style="width:100%; max-width:980px; background:#ffffff; border-radius:10px; padding:8px; box-shadow:0 6px 18px rgba(0,0,0,0.08);">
+  <iframe src="{embed}" width="100%" height="{height}" frameborder="0" style="border:0;border-radius:6px;"></iframe>
+  <div style="margin-top:8px; font-weight:600; display:flex; justify-content:space-between; align-items:center;">
+    <div>{label}</div>
+    <div><button style="background:none;border:none;color:#0B69A3;cursor:pointer;font-weight:600;padding:0;margin:0" onclick="window.open('{street}', '_blank'); return false;">Abrir Street View</button> · <button style="background:none;border:none;color:#0B69A3;cursor:pointer;font-weight:600;padding:0;margin:0" onclick="window.open('{maps_link}', '_blank'); return false;">Abrir en Google Maps</button></div>
+  </div>
+</div>
+    """
+    return html
+
+# ---------------- PDF generation ----------------
+
+def generar_pdf(top_entrantes, top_salientes, logo=None):
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=letter, rightMargin=36, leftMargin=36, topMargin=36, bottomMargin=36)
+    styles = getSampleStyleSheet()
+    elementos = []
+    elementos.append(Paragraph('Reporte de Llamadas', styles['Title']))
+    elementos.append(Spacer(1, 8))
+    fecha = datetime.now().strftime('%d/%m/%Y %H:%M')
+    elementos.append(Paragraph(f'Fecha del reporte: {fecha}', styles['Normal']))
+    elementos.append(Spacer(1, 12))
+
+    if top_entrantes:
+        elementos.append(Paragraph('Top 10 - Entrantes', styles['Heading2']))
+        tabla = [['Número', 'Frecuencia']] + [[str(x[0]), x[1]] for x in top_entrantes]
+        t = Table(tabla, hAlign='LEFT')
+        t.setStyle(TableStyle([('BACKGROUND', (0,0), (-1,0), colors.HexColor('#0B69A3')), ('TEXTCOLOR',(0,0),(-1,0),colors.white), ('GRID',(0,0),(-1,-1),0.25,colors.grey)]))
+        elementos.append(t)
+        elementos.append(Spacer(1,12))
+        # Gráfico para Top Entrantes
+        try:
+            fig_ent = generar_grafica(top_entrantes, 'Top Entrantes')
+            imgbuf_ent = BytesIO()
+            fig_ent.savefig(imgbuf_ent, format='PNG')
+            imgbuf_ent.seek(0)
+            elementos.append(Image(imgbuf_ent, width=400, height=250))
+            elementos.append(Spacer(1,12))
+        except Exception:
+            pass
+
+    if top_salientes:
+        elementos.append(Paragraph('Top 10 - Salientes', styles['Heading2']))
+        tabla = [['Número', 'Frecuencia']] + [[str(x[0]), x[1]] for x in top_salientes]
+        t = Table(tabla, hAlign='LEFT')
+        t.setStyle(TableStyle([('BACKGROUND', (0,0), (-1,0), colors.HexColor('#0B8A3E')), ('TEXTCOLOR',(0,0),(-1,0),colors.white), ('GRID',(0,0),(-1,-1),0.25,colors.grey)]))
+        elementos.append(t)
+        try:
+            fig_sal = generar_grafica(top_salientes, 'Top Salientes')
+            imgbuf_sal = BytesIO()
+            fig_sal.savefig(imgbuf_sal, format='PNG')
+            imgbuf_sal.seek(0)
+            elementos.append(Image(imgbuf_sal, width=400, height=250))
+            elementos.append(Spacer(1,12))
+        except Exception:
+            pass
+        elementos.append(PageBreak())
+
+    doc.build(elementos)
+    buf.seek(0)
+    return buf
+
+
+def generar_pdf_con_extra(base_pdf_buffer, top_entrantes, top_salientes, coords_ent, coords_sal, logo=None):
+    # Construye páginas adicionales con LAT/LON y links (Maps + Street) y luego concatena
+    extra = BytesIO()
+    doc = SimpleDocTemplate(extra, pagesize=letter, rightMargin=36, leftMargin=36, topMargin=36, bottomMargin=36)
+    styles = getSampleStyleSheet()
+    normal = styles['Normal']
+    elements = []
+    elements.append(Paragraph('Ubicaciones (Top 10) - Links de Google Maps y Street View', styles['Title']))
+    elements.append(Spacer(1,8))
+
+    # Tabla con enlaces (usa Paragraph para que los links sean clicables en el PDF)
+    tabla = [['Tipo','Número','Lat','Lon','Veces','Maps','Street View']]
+    # Entrantes
+    for num,_ in top_entrantes:
+        info = coords_ent.get(num)
+        if info:
+            maps = _google_maps_search_url(info['lat'], info['lon'])
+            street = _google_street_url(info['lat'], info['lon'])
+            maps_para = Paragraph(f'<a href="{maps}" >Abrir Maps</a>', normal)
+            street_para = Paragraph(f'<a href="{street}" >Abrir Street</a>', normal)
+            tabla.append(['Entrante', str(num), f'{info["lat"]:.6f}', f'{info["lon"]:.6f}', str(info['count']), maps_para, street_para])
+        else:
+            tabla.append(['Entrante', str(num), 'N/D', 'N/D', '0', 'N/D', 'N/D'])
+
+    # Salientes
+    for num,_ in top_salientes:
+        info = coords_sal.get(num)
+        if info:
+            maps = _google_maps_search_url(info['lat'], info['lon'])
+            street = _google_street_url(info['lat'], info['lon'])
+            maps_para = Paragraph(f'<a href="{maps}" >Abrir Maps</a>', normal)
+            street_para = Paragraph(f'<a href="{street}" >Abrir Street</a>', normal)
+            tabla.append(['Saliente', str(num), f'{info["lat"]:.6f}', f'{info["lon"]:.6f}', str(info['count']), maps_para, street_para])
+        else:
+            tabla.append(['Saliente', str(num), 'N/D', 'N/D', '0', 'N/D', 'N/D'])
+
+    t = Table(tabla, hAlign='LEFT', colWidths=[60,60,80,80,50,100,100])
+    t.setStyle(TableStyle([
+        ('GRID',(0,0),(-1,-1),0.25,colors.grey),
+        ('BACKGROUND',(0,0),(-1,0),colors.HexColor('#0B69A3')),
+        ('TEXTCOLOR',(0,0),(-1,0),colors.white),
+        ('VALIGN',(0,0),(-1,-1),'MIDDLE'),
+    ]))
+    elements.append(t)
+    elements.append(PageBreak())
+
+    # Página final: listado de enlaces (solo etiquetas, no la ruta completa)
+    elements.append(Paragraph('Listado completo de URLs (Google Maps y Street View)', styles['Heading2']))
+    elements.append(Spacer(1,6))
+    if top_entrantes:
+        elements.append(Paragraph('Entrantes:', styles['Heading3']))
+        for num,_ in top_entrantes:
+            info = coords_ent.get(num)
+            if info:
+                maps = _google_maps_search_url(info['lat'], info['lon'])
+                street = _google_street_url(info['lat'], info['lon'])
+                elements.append(Paragraph(f'{num}: <a href="{maps}" >Abrir Maps</a>    <a href="{street}" >Abrir Street</a>', normal))
+                elements.append(Spacer(1,4))
+
+    if top_salientes:
+        elements.append(Paragraph('Salientes:', styles['Heading3']))
+        for num,_ in top_salientes:
+            info = coords_sal.get(num)
+            if info:
+                maps = _google_maps_search_url(info['lat'], info['lon'])
+                street = _google_street_url(info['lat'], info['lon'])
+                elements.append(Paragraph(f'{num}: <a href="{maps}" >Abrir Maps</a>    <a href="{street}" >Abrir Street</a>', normal))
+                elements.append(Spacer(1,4))
+
+    doc.build(elements)
+    extra.seek(0)
+
+    if not _HAVE_PYPDF:
+        return base_pdf_buffer
+
+    try:
+        base_reader = PdfReader(base_pdf_buffer)
+        extra_reader = PdfReader(extra)
+        writer = PdfWriter()
+        for p in base_reader.pages:
+            writer.add_page(p)
+        for p in extra_reader.pages:
+            writer.add_page(p)
+        out = BytesIO()
+        writer.write(out)
+        out.seek(0)
+        result_bytes = out.getvalue()
+        # Post-process to set NewWindow flag on link annotations
+        try:
+            processed = _ensure_pdf_links_new_window(result_bytes)
+            return BytesIO(processed)
+        except Exception:
+            return BytesIO(result_bytes)
+    except Exception:
+        return base_pdf_buffer
+
+
+def describir_filtro(filtro):
+    """
+    Texto del filtro por fecha y hora activo. `filtro` es un dict con desde / hasta (fechas o texto
+    ISO), hora_desde / hora_hasta y n_llamadas (lo que retorna filtrar_por_tiempo).
+    """
+    desde = pd.Timestamp(filtro['desde']).strftime('%d/%m/%Y')
+    hasta = pd.Timestamp(filtro['hasta']).strftime('%d/%m/%Y')
+    hora_desde, hora_hasta = filtro.get('hora_desde', 0), filtro.get('hora_hasta', 23)
+    horario = f', de {hora_desde:02d}:00 a {hora_hasta:02d}:59' if (hora_desde, hora_hasta) != (0, 23) else ''
+    return f'{desde} a {hasta}{horario} — {filtro["n_llamadas"]} llamadas'
+
+def generar_pdf_full(top_entrantes, top_salientes, coords_ent, coords_sal, logo=None, filtro=None):
+    """
+    Genera un único PDF que incluye tablas principales, gráficas y páginas adicionales
+    con enlaces de Google Maps y Street View.
+    Esto evita concatenar varios PDFs y preserva correctamente las anotaciones (links).
+    Con `filtro` (ver describir_filtro) el encabezado indica que el reporte cubre solo ese rango.
+    Retorna un BytesIO con el PDF final.
+    """
+    buf = BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=letter, rightMargin=36, leftMargin=36, topMargin=36, bottomMargin=36)
+    styles = getSampleStyleSheet()
+    normal = styles['Normal']
+    elementos = []
+
+    # Portada / encabezado
+    elementos.append(Paragraph('Reporte de Llamadas', styles['Title']))
+    elementos.append(Spacer(1, 8))
+    fecha = datetime.now().strftime('%d/%m/%Y %H:%M')
+    elementos.append(Paragraph(f'Fecha del reporte: {fecha}', styles['Normal']))
+    if filtro:
+        elementos.append(Paragraph(f'Filtro por fecha y hora: {describir_filtro(filtro)}', styles['Normal']))
+    elementos.append(Spacer(1, 12))
+
+    # Top Entrantes
+    if top_entrantes:
+        elementos.append(Paragraph('Top 10 - Entrantes', styles['Heading2']))
+        tabla_ent = [['Número', 'Frecuencia']] + [[str(x[0]), x[1]] for x in top_entrantes]
+        t_ent = Table(tabla_ent, hAlign='LEFT')
+        t_ent.setStyle(TableStyle([('BACKGROUND', (0,0), (-1,0), colors.HexColor('#0B69A3')), ('TEXTCOLOR',(0,0),(-1,0),colors.white), ('GRID',(0,0),(-1,-1),0.25,colors.grey)]))
+        elementos.append(t_ent)
+        elementos.append(Spacer(1,12))
+        try:
+            fig_ent = generar_grafica(top_entrantes, 'Top Entrantes')
+            imgbuf_ent = BytesIO()
+            fig_ent.savefig(imgbuf_ent, format='PNG')
+            imgbuf_ent.seek(0)
+            elementos.append(Image(imgbuf_ent, width=400, height=250))
+            elementos.append(Spacer(1,12))
+        except Exception:
+            pass
+
+    # Top Salientes
+    if top_salientes:
+        elementos.append(Paragraph('Top 10 - Salientes', styles['Heading2']))
+        tabla_sal = [['Número', 'Frecuencia']] + [[str(x[0]), x[1]] for x in top_salientes]
+        t_sal = Table(tabla_sal, hAlign='LEFT')
+        t_sal.setStyle(TableStyle([('BACKGROUND', (0,0), (-1,0), colors.HexColor('#0B8A3E')), ('TEXTCOLOR',(0,0),(-1,0),colors.white), ('GRID',(0,0),(-1,-1),0.25,colors.grey)]))
+        elementos.append(t_sal)
+        elementos.append(Spacer(1,12))
+        try:
+            fig_sal = generar_grafica(top_salientes, 'Top Salientes')
+            imgbuf_sal = BytesIO()
+            fig_sal.savefig(imgbuf_sal, format='PNG')
+            imgbuf_sal.seek(0)
+            elementos.append(Image(imgbuf_sal, width=400, height=250))
+            elementos.append(Spacer(1,12))
+        except Exception:
+            pass
+
+    # Page break before locations
+    elementos.append(PageBreak())
+
+    # Página de Ubicaciones - Tabla con enlaces
+    elementos.append(Paragraph('Ubicaciones (Top 10) - Links de Google Maps y Street View', styles['Title']))
+    elementos.append(Spacer(1,8))
+    tabla_links = [['Tipo','Número','Lat','Lon','Veces','Maps','Street View']]
+    for num,_ in top_entrantes:
+        info = coords_ent.get(num)
+        if info:
+            maps = _google_maps_search_url(info['lat'], info['lon'])
+            street = _google_street_url(info['lat'], info['lon'])
+            maps_para = Paragraph(f'<a href="{maps}">Abrir Maps</a>', normal)
+            street_para = Paragraph(f'<a href="{street}">Abrir Street</a>', normal)
+            tabla_links.append(['Entrante', str(num), f'{info["lat"]:.6f}', f'{info["lon"]:.6f}', str(info['count']), maps_para, street_para])
+        else:
+            tabla_links.append(['Entrante', str(num), 'N/D', 'N/D', '0', 'N/D', 'N/D'])
+
+    for num,_ in top_salientes:
+        info = coords_sal.get(num)
+        if info:
+            maps = _google_maps_search_url(info['lat'], info['lon'])
+            street = _google_street_url(info['lat'], info['lon'])
+            maps_para = Paragraph(f'<a href="{maps}">Abrir Maps</a>', normal)
+            street_para = Paragraph(f'<a href="{street}">Abrir Street</a>', normal)
+            tabla_links.append(['Saliente', str(num), f'{info["lat"]:.6f}', f'{info["lon"]:.6f}', str(info['count']), maps_para, street_para])
+        else:
+            tabla_links.append(['Saliente', str(num), 'N/D', 'N/D', '0', 'N/D', 'N/D'])
+
+    tlinks = Table(tabla_links, hAlign='LEFT', colWidths=[60,60,80,80,50,100,100])
+    tlinks.setStyle(TableStyle([('GRID',(0,0),(-1,-1),0.25,colors.grey),
+                                ('BACKGROUND',(0,0),(-1,0),colors.HexColor('#0B69A3')),
+                                ('TEXTCOLOR',(0,0),(-1,0),colors.white),
+                                ('VALIGN',(0,0),(-1,-1),'MIDDLE')]))
+
+    elementos.append(tlinks)
+    elementos.append(PageBreak())
+
+    # Página final: listado de enlaces (solo etiquetas)
+    elementos.append(Paragraph('Listado completo de URLs (Google Maps y Street View)', styles['Heading2']))
+    elementos.append(Spacer(1,6))
+    if top_entrantes:
+        elementos.append(Paragraph('Entrantes:', styles['Heading3']))
+        for num,_ in top_entrantes:
+            info = coords_ent.get(num)
+            if info:
+                maps = _google_maps_search_url(info['lat'], info['lon'])
+                street = _google_street_url(info['lat'], info['lon'])
+                elementos.append(Paragraph(f'{num}: <a href="{maps}">Abrir Maps</a>    <a href="{street}">Abrir Street</a>', normal))
+                elementos.append(Spacer(1,4))
+
+    if top_salientes:
+        elementos.append(Paragraph('Salientes:', styles['Heading3']))
+        for num,_ in top_salientes:
+            info = coords_sal.get(num)
+            if info:
+                maps = _google_maps_search_url(info['lat'], info['lon'])
+                street = _google_street_url(info['lat'], info['lon'])
+                elementos.append(Paragraph(f'{num}: <a href="{maps}">Abrir Maps</a>    <a href="{street}">Abrir Street</a>', normal))
+                elementos.append(Spacer(1,4))
+
+    doc.build(elementos)
+    buf.seek(0)
+
+    # Post-process PDF bytes to set /NewWindow on URI annotations where possible
+    final_bytes = buf.getvalue()
+    try:
+        final_bytes = _ensure_pdf_links_new_window(final_bytes)
+    except Exception:
+        pass
+
+    return BytesIO(final_bytes)
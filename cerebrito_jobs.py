@@ -0,0 +1,793 @@
+"""
+Servicio local de trabajos de Cerebrito.
+
+El análisis de archivos y la generación del PDF se ejecutan como trabajos en una cola, atendidos
+por un pool acotado de procesos. Antes de iniciar cada trabajo se estima su memoria y solo se admite
+si cabe en el presupuesto del servicio, para que varias cargas simultáneas no tumben el servidor.
+
+La interfaz Streamlit usa el servicio directamente; también puede levantarse solo, con una API HTTP
+para enviar trabajos desde scripts:
+
+    python cerebrito_jobs.py --puerto 8765 --workers 2 --memoria-mb 4096
+
+    POST   /trabajos/analisis?nombre=a.csv&col_ent=1&col_sal=2[&col_fecha=3&col_hora=4&col_lat=7&col_lon=8&fila=1]
+           (cuerpo: bytes del archivo)
+    POST   /trabajos/pdf          (cuerpo JSON: top_ent, top_sal, coords_ent, coords_sal[, filtro])
+    GET    /trabajos              lista de trabajos
+    GET    /trabajos/<id>         estado y progreso
+    GET    /trabajos/<id>/resultado   resumen JSON (análisis) o el PDF
+    DELETE /trabajos/<id>         cancelar / descartar
+
+La API solo ve los trabajos enviados por ella (no los de las sesiones de la UI). Fuera de loopback
+exige un token (`--token` o CEREBRITO_API_TOKEN) en `Authorization: Bearer <token>`.
+"""
+import argparse
+import collections
+import hmac
+import ipaddress
+import json
+import multiprocessing as mp
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import wait
+from urllib.parse import urlparse, parse_qs
+
+from cerebrito_core import (
+    leer_archivo, detectar_columnas_coordenadas, analizar_segmento, nuevo_analisis, fusionar_segmento, generar_pdf_full,
+)
+
+# Estimación de memoria por trabajo (bytes), a partir de picos medidos en un worker (lectura, análisis y
+# volcado del resultado): el proceso con pandas ya importado ocupa ~150 MB; un CSV de 1M filas (92 MB,
+# números y coordenadas como texto) sube ~6.5x su tamaño y un XLSX (comprimido, openpyxl) ~25x.
+# Los factores dejan margen sobre lo medido; además el servicio sigue el RSS real de cada worker.
+MEMORIA_BASE = 150 * 1024 * 1024
+FACTOR_MEMORIA_CSV = 10
+FACTOR_MEMORIA_XLSX = 40
+# Un resultado cargado en la sesión de la UI ocupa ~1.3x el tamaño de su pickle (medido)
+FACTOR_MEMORIA_RESULTADO = 1.5
+
+ESTADOS_ACTIVOS = ('en_cola', 'ejecutando')
+
+
+class TrabajoRechazado(Exception):
+    """El servicio no admite el trabajo (cola llena o memoria estimada por encima del límite)."""
+
+
+class TrabajoDemasiadoGrande(TrabajoRechazado):
+    """El trabajo (o lo que la sesión tendría cargado) excede el límite por sí solo: reintentar no sirve."""
+
+
+def estimar_memoria_analisis(n_bytes, nombre):
+    factor = FACTOR_MEMORIA_CSV if nombre.lower().endswith('.csv') else FACTOR_MEMORIA_XLSX
+    return MEMORIA_BASE + n_bytes * factor
+
+
+def _memoria_disponible():
+    # MemAvailable de Linux; None si no se puede consultar
+    try:
+        with open('/proc/meminfo') as f:
+            for linea in f:
+                if linea.startswith('MemAvailable:'):
+                    return int(linea.split()[1]) * 1024
+    except Exception:
+        pass
+    return None
+
+
+def _memoria_proceso(pid):
+    # RSS actual de un proceso (Linux); None si no se puede consultar
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for linea in f:
+                if linea.startswith('VmRSS:'):
+                    return int(linea.split()[1]) * 1024
+    except Exception:
+        pass
+    return None
+
+
+def _memoria_total():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except Exception:
+        return None
+
+
+def _guardar_entrada(ruta, datos, n_bytes, bloque=2**20):
+    # `datos`: bytes o un archivo abierto del que se copian `n_bytes` por bloques (sin cargarlo entero)
+    with open(ruta, 'wb') as f:
+        if isinstance(datos, (bytes, bytearray, memoryview)):
+            f.write(datos)
+            return
+        faltan = n_bytes
+        while faltan > 0:
+            trozo = datos.read(min(bloque, faltan))
+            if not trozo:
+                raise ValueError(f'El cuerpo terminó antes de tiempo: faltan {faltan} de {n_bytes} bytes.')
+            f.write(trozo)
+            faltan -= len(trozo)
+
+# ---------------- trabajos (se ejecutan dentro de los procesos del pool) ----------------
+
+def resumen_analisis(segmento):
+    # Resumen JSON-serializable del resultado de un trabajo de análisis
+    estado = fusionar_segmento(nuevo_analisis({'use_geo': segmento['lat'] is not None}), segmento)
+    return {
+        'n_filas': estado['n_filas'],
+        'top_ent': [[num, int(veces)] for num, veces in estado['top_ent']],
+        'top_sal': [[num, int(veces)] for num, veces in estado['top_sal']],
+        'coords_ent': estado['coords_ent'],
+        'coords_sal': estado['coords_sal'],
+        'dia_ent': estado['dia_ent'],
+        'dia_sal': estado['dia_sal'],
+    }
+
+
+def _trabajo_analisis(progreso, ruta_entrada, nombre, config, resumen=False):
+    # Retorna {'config', 'segmento'} (config con las coordenadas ya resueltas) o, con `resumen`, el resumen JSON
+    progreso(0.02, 'Leyendo archivo')
+    df = leer_archivo(ruta_entrada, nombre=nombre)
+    columnas = [config.get(k) for k in ('col_ent', 'col_sal', 'col_fecha', 'col_hora', 'col_lat', 'col_lon')]
+    faltantes = [c for c in columnas if c is not None and c not in df.columns]
+    if faltantes:
+        raise ValueError(f'El archivo no tiene las columnas del análisis: {faltantes}')
+    df = df.iloc[config.get('fila', 1)-1:].reset_index(drop=True)
+
+    config = dict(config)
+    if config.get('detectar_coords'):
+        progreso(0.25, 'Detectando coordenadas')
+        col_lat, col_lon = detectar_columnas_coordenadas(df)
+        if col_lat is not None and col_lon is not None:
+            config.update(col_lat=col_lat, col_lon=col_lon, use_geo=True)
+        # Resuelto: al agregar archivos con esta config se usan las mismas columnas
+        config['detectar_coords'] = False
+
+    def progreso_analisis(fraccion, mensaje):
+        progreso(0.3 + 0.7 * fraccion, mensaje)
+
+    segmento = analizar_segmento(df, config['col_ent'], config['col_sal'], config.get('col_fecha'), config.get('col_hora'),
+                                 config.get('col_lat'), config.get('col_lon'), nombre=nombre, progreso=progreso_analisis)
+    if resumen:
+        return resumen_analisis(segmento)
+    return {'config': config, 'segmento': segmento}
+
+
+def _trabajo_pdf(progreso, top_ent, top_sal, coords_ent, coords_sal, filtro=None):
+    progreso(0.1, 'Generando PDF')
+    return generar_pdf_full(top_ent, top_sal, coords_ent, coords_sal, filtro=filtro).getvalue()
+
+
+_TIPOS = {
+    'analisis': _trabajo_analisis,
+    'pdf': _trabajo_pdf,
+}
+
+
+def _worker(tareas, eventos, max_tareas):
+    # Proceso del pool: atiende tareas hasta `max_tareas` (None = sin límite) y termina.
+    # `tareas` y `eventos` son pipes propios del proceso: si se cancela, se descartan con él.
+    # El resultado se guarda en disco para no pasar objetos grandes por el pipe de eventos.
+    hechas = 0
+    while max_tareas is None or hechas < max_tareas:
+        try:
+            tarea = tareas.recv()
+        except EOFError:
+            break
+        if tarea is None:
+            break
+        id_trabajo, tipo, args, ruta = tarea
+
+        def progreso(fraccion, mensaje=''):
+            eventos.send(('progreso', id_trabajo, float(fraccion), mensaje))
+
+        try:
+            resultado = _TIPOS[tipo](progreso, **args)
+            with open(ruta, 'wb') as f:
+                pickle.dump(resultado, f, protocol=pickle.HIGHEST_PROTOCOL)
+            eventos.send(('terminado', id_trabajo, 1.0, ''))
+        except Exception as e:
+            eventos.send(('error', id_trabajo, None, f'{type(e).__name__}: {e}'))
+        hechas += 1
+
+# ---------------- servicio ----------------
+
+class ServicioTrabajos:
+    """
+    Cola de trabajos con un pool acotado de procesos y admisión por memoria.
+
+    - `max_workers`: procesos simultáneos.
+    - `memoria_max`: presupuesto (bytes) para los trabajos en ejecución más lo que las sesiones de la UI
+      tienen cargado; por defecto la mitad de la memoria física. Cada trabajo cuenta lo estimado o su RSS
+      real si es mayor. Un trabajo que no cabe espera en la cola; uno que excede el presupuesto por sí
+      solo se rechaza al enviarlo.
+    - `memoria_sesion_max`: límite de lo que una sesión puede tener cargado (ver reservar_sesion); por
+      defecto un cuarto de `memoria_max`.
+    - `max_en_cola`: trabajos en espera antes de rechazar nuevos envíos.
+    - `tareas_por_worker`: cada proceso se reemplaza tras ese número de trabajos (1 = proceso nuevo por
+      trabajo, así la memoria de un análisis grande se devuelve al sistema). Siempre hay procesos
+      ya iniciados esperando, por lo que el costo de arranque no se paga al enviar.
+    - `retener_segundos`: tiempo que se conservan los trabajos terminados y sus resultados.
+    """
+
+    def __init__(self, max_workers=2, memoria_max=None, max_en_cola=20, tareas_por_worker=1, retener_segundos=3600,
+                 memoria_sesion_max=None):
+        if memoria_max is None:
+            total = _memoria_total()
+            memoria_max = total // 2 if total else 4 * 1024 ** 3
+        self.max_workers = max_workers
+        self.memoria_max = memoria_max
+        self.memoria_sesion_max = memoria_sesion_max if memoria_sesion_max is not None else memoria_max // 4
+        self.max_en_cola = max_en_cola
+        self.tareas_por_worker = tareas_por_worker
+        self.retener_segundos = retener_segundos
+
+        self._ctx = mp.get_context('spawn')
+        self._cond = threading.Condition()
+        self._trabajos = {}
+        self._cola = collections.deque()
+        self._workers = []
+        # Workers terminados por cancelación: sus pipes se cierran desde el hilo del bucle
+        self._descartados = []
+        # id de sesión -> {'memoria': bytes cargados en la UI, 'visto': último aviso}
+        self._sesiones = {}
+        self._cerrado = False
+        self._dir = tempfile.mkdtemp(prefix='cerebrito_trabajos_')
+
+        with self._cond:
+            self._completar_pool()
+        self._hilo = threading.Thread(target=self._bucle, name='cerebrito-trabajos', daemon=True)
+        self._hilo.start()
+
+    # ----- API pública -----
+
+    def enviar_analisis(self, datos, nombre, config, resumen=False, origen='ui', n_bytes=None):
+        """
+        Encola el análisis de un archivo: `datos` son bytes o un archivo abierto del que se leen `n_bytes`
+        (se copian a disco por bloques mientras el trabajo espera). El resultado es {'config': config
+        resuelta, 'segmento': segmento de analizar_segmento} o, con `resumen`, el resumen JSON.
+        `origen` ('ui' o 'api') separa los trabajos que la API HTTP puede ver.
+        """
+        n_bytes = len(datos) if n_bytes is None else n_bytes
+        return self._enviar('analisis', {'nombre': nombre, 'config': config, 'resumen': resumen},
+                            estimar_memoria_analisis(n_bytes, nombre), origen, entrada=(datos, n_bytes))
+
+    def validar_analisis(self, n_bytes, nombre):
+        """Lanza TrabajoRechazado si un análisis de `n_bytes` no se admitiría ahora (antes de recibir el archivo)."""
+        with self._cond:
+            self._validar_envio(estimar_memoria_analisis(n_bytes, nombre))
+
+    def enviar_pdf(self, top_ent, top_sal, coords_ent, coords_sal, filtro=None, origen='ui'):
+        """
+        Encola la generación del PDF (`filtro`: el filtro por fecha y hora activo, ver describir_filtro).
+        El resultado son los bytes del PDF.
+        """
+        return self._enviar('pdf', {'top_ent': top_ent, 'top_sal': top_sal, 'coords_ent': coords_ent, 'coords_sal': coords_sal,
+                                    'filtro': filtro},
+                            MEMORIA_BASE, origen)
+
+    def reservar_sesion(self, id_sesion, memoria):
+        """
+        Registra cuánta memoria (bytes) tiene cargada una sesión de la UI; cuenta en el presupuesto de los
+        trabajos. Se llama en cada rerun: una sesión sin avisos por `retener_segundos` se libera. Lanza
+        TrabajoDemasiadoGrande si supera `memoria_sesion_max`.
+        """
+        if memoria > self.memoria_sesion_max:
+            raise TrabajoDemasiadoGrande(f'La sesión tendría ~{memoria // 2**20} MB cargados y el límite por sesión es '
+                                         f'{self.memoria_sesion_max // 2**20} MB.')
+        with self._cond:
+            self._sesiones[id_sesion] = {'memoria': memoria, 'visto': time.time()}
+
+    def liberar_sesion(self, id_sesion):
+        with self._cond:
+            self._sesiones.pop(id_sesion, None)
+            self._admitir()
+            self._cond.notify_all()
+
+    def estado(self, id_trabajo):
+        """Copia del estado del trabajo (sin datos de entrada) o None si no existe."""
+        with self._cond:
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is None:
+                return None
+            return self._publico(trabajo)
+
+    def listar(self, origen=None):
+        with self._cond:
+            return [self._publico(t) for t in self._trabajos.values() if origen is None or t['origen'] == origen]
+
+    def esperar(self, id_trabajo, timeout=None):
+        """Bloquea hasta que el trabajo deja de estar en cola/ejecución; retorna su estado."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                trabajo = self._trabajos.get(id_trabajo)
+                if trabajo is None or trabajo['estado'] not in ESTADOS_ACTIVOS:
+                    return self._publico(trabajo) if trabajo else None
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return self._publico(trabajo)
+                self._cond.wait(restante)
+
+    def resultado(self, id_trabajo):
+        """Resultado de un trabajo terminado, o None si no existe o aún no termina."""
+        with self._cond:
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is None or trabajo['estado'] != 'terminado':
+                return None
+            ruta = trabajo['ruta']
+        with open(ruta, 'rb') as f:
+            return pickle.load(f)
+
+    def cancelar(self, id_trabajo):
+        """Cancela un trabajo en cola o en ejecución (su proceso se termina). Retorna False si ya no estaba activo."""
+        with self._cond:
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is None or trabajo['estado'] not in ESTADOS_ACTIVOS:
+                return False
+            if trabajo['estado'] == 'en_cola':
+                self._cola.remove(id_trabajo)
+            else:
+                for w in [w for w in self._workers if w['trabajo'] == id_trabajo]:
+                    w['proceso'].terminate()
+                    self._workers.remove(w)
+                    self._descartados.append(w)
+                self._completar_pool()
+            self._finalizar(trabajo, 'cancelado')
+            self._cond.notify_all()
+            return True
+
+    def descartar(self, id_trabajo):
+        """Cancela si hace falta y elimina el trabajo y su resultado."""
+        self.cancelar(id_trabajo)
+        with self._cond:
+            trabajo = self._trabajos.pop(id_trabajo, None)
+        if trabajo is not None:
+            self._borrar_resultado(trabajo)
+        return trabajo is not None
+
+    def cerrar(self):
+        with self._cond:
+            self._cerrado = True
+            for w in self._workers:
+                w['proceso'].terminate()
+            self._descartados.extend(self._workers)
+            self._workers = []
+            self._cond.notify_all()
+        self._hilo.join(timeout=5)
+        self._cerrar_descartados()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    # ----- internos (siempre con self._cond tomado) -----
+
+    def _validar_envio(self, memoria):
+        if self._cerrado:
+            raise TrabajoRechazado('El servicio de trabajos está cerrado.')
+        if memoria > self.memoria_max:
+            raise TrabajoDemasiadoGrande(f'El trabajo requiere ~{memoria // 2**20} MB y el límite del servicio es '
+                                         f'{self.memoria_max // 2**20} MB.')
+        if len(self._cola) >= self.max_en_cola:
+            raise TrabajoRechazado(f'Hay {len(self._cola)} trabajos en espera; intenta más tarde.')
+
+    def _enviar(self, tipo, args, memoria, origen, entrada=None):
+        id_trabajo = uuid.uuid4().hex[:12]
+        ruta_entrada = None
+        if entrada is not None:
+            # La entrada va a disco (fuera del lock) en lugar de quedar en memoria mientras espera
+            with self._cond:
+                self._validar_envio(memoria)
+            ruta_entrada = os.path.join(self._dir, f'{id_trabajo}.entrada')
+            try:
+                _guardar_entrada(ruta_entrada, *entrada)
+            except Exception:
+                self._borrar_archivo(ruta_entrada)
+                raise
+            args['ruta_entrada'] = ruta_entrada
+        with self._cond:
+            try:
+                self._validar_envio(memoria)
+            except TrabajoRechazado:
+                self._borrar_archivo(ruta_entrada)
+                raise
+            self._trabajos[id_trabajo] = {
+                'id': id_trabajo,
+                'tipo': tipo,
+                'origen': origen,
+                'estado': 'en_cola',
+                'progreso': 0.0,
+                'mensaje': 'En cola',
+                'error': None,
+                'memoria': memoria,
+                'rss': None,
+                'memoria_resultado': None,
+                'creado': time.time(),
+                'iniciado': None,
+                'terminado': None,
+                'args': args,
+                'entrada': ruta_entrada,
+                'ruta': os.path.join(self._dir, f'{id_trabajo}.pkl'),
+            }
+            self._cola.append(id_trabajo)
+            self._admitir()
+            self._cond.notify_all()
+            return id_trabajo
+
+    def _publico(self, trabajo):
+        info = {k: v for k, v in trabajo.items() if k not in ('args', 'entrada', 'ruta')}
+        info['posicion'] = self._cola.index(trabajo['id']) + 1 if trabajo['estado'] == 'en_cola' else None
+        return info
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                if self._cerrado:
+                    return
+                self._cerrar_descartados()
+                conexiones = {w['eventos']: w for w in self._workers}
+            if conexiones:
+                listas = wait(list(conexiones), timeout=0.2)
+            else:
+                time.sleep(0.2)
+                listas = []
+            with self._cond:
+                if self._cerrado:
+                    return
+                for conexion in listas:
+                    w = conexiones[conexion]
+                    # Un worker cancelado mientras se esperaba ya no está en el pool: su pipe se ignora
+                    if w in self._workers:
+                        self._leer_eventos(w)
+                self._revisar_workers()
+                self._admitir()
+                self._purgar()
+                self._cond.notify_all()
+
+    def _aplicar_evento(self, evento):
+        tipo, id_trabajo, fraccion, mensaje = evento
+        trabajo = self._trabajos.get(id_trabajo)
+        # Eventos de trabajos ya cancelados (o de procesos terminados) se ignoran
+        if trabajo is None or trabajo['estado'] != 'ejecutando':
+            return
+        if tipo == 'progreso':
+            trabajo['progreso'] = fraccion
+            trabajo['mensaje'] = mensaje
+            return
+        for w in self._workers:
+            if w['trabajo'] == id_trabajo:
+                w['trabajo'] = None
+        if tipo == 'terminado':
+            trabajo['progreso'] = 1.0
+            try:
+                # Lo que ocupará el resultado ya cargado (p. ej. en la sesión de la UI)
+                trabajo['memoria_resultado'] = int(os.path.getsize(trabajo['ruta']) * FACTOR_MEMORIA_RESULTADO)
+            except OSError:
+                pass
+            self._finalizar(trabajo, 'terminado')
+        else:
+            trabajo['error'] = mensaje
+            self._finalizar(trabajo, 'error')
+
+    def _leer_eventos(self, w):
+        try:
+            while w['eventos'].poll():
+                self._aplicar_evento(w['eventos'].recv())
+        except (EOFError, OSError):
+            pass
+
+    def _revisar_workers(self):
+        # RSS real de los trabajos en ejecución: si supera lo estimado, la admisión cuenta el valor medido
+        for w in self._workers:
+            trabajo = self._trabajos.get(w['trabajo']) if w['trabajo'] else None
+            if trabajo is not None and trabajo['estado'] == 'ejecutando':
+                rss = _memoria_proceso(w['proceso'].pid)
+                if rss is not None:
+                    trabajo['rss'] = max(trabajo['rss'] or 0, rss)
+        for w in [w for w in self._workers if not w['proceso'].is_alive()]:
+            # Un proceso que sale normalmente ya dejó su evento en el pipe: aplicarlo antes de decidir
+            self._leer_eventos(w)
+            self._workers.remove(w)
+            self._descartados.append(w)
+            trabajo = self._trabajos.get(w['trabajo']) if w['trabajo'] else None
+            if trabajo is not None and trabajo['estado'] == 'ejecutando':
+                trabajo['error'] = f'El proceso terminó inesperadamente (código {w["proceso"].exitcode}).'
+                self._finalizar(trabajo, 'error')
+        self._completar_pool()
+
+    def _completar_pool(self):
+        while not self._cerrado and len(self._workers) < self.max_workers:
+            tareas_lectura, tareas = self._ctx.Pipe(duplex=False)
+            eventos, eventos_escritura = self._ctx.Pipe(duplex=False)
+            proceso = self._ctx.Process(target=_worker, args=(tareas_lectura, eventos_escritura, self.tareas_por_worker),
+                                        daemon=True)
+            proceso.start()
+            # Los extremos del hijo se cierran aquí para detectar EOF cuando el proceso termina
+            tareas_lectura.close()
+            eventos_escritura.close()
+            self._workers.append({'proceso': proceso, 'tareas': tareas, 'eventos': eventos, 'trabajo': None, 'hechas': 0})
+
+    def _cerrar_descartados(self):
+        for w in self._descartados:
+            w['tareas'].close()
+            w['eventos'].close()
+            w['proceso'].join(timeout=0)
+        self._descartados = []
+
+    def _memoria_en_uso(self):
+        # Trabajos en ejecución (lo estimado o su RSS medido, lo que sea mayor) más lo cargado en las sesiones
+        en_ejecucion = sum(max(t['memoria'], t['rss'] or 0) for t in self._trabajos.values() if t['estado'] == 'ejecutando')
+        return en_ejecucion + sum(s['memoria'] for s in self._sesiones.values())
+
+    def _admitir(self):
+        # FIFO: si el primero de la cola no cabe, los demás esperan (evita que uno grande espere para siempre)
+        while self._cola:
+            trabajo = self._trabajos[self._cola[0]]
+            libres = [w for w in self._workers if w['trabajo'] is None and w['proceso'].is_alive()
+                      and (self.tareas_por_worker is None or w['hechas'] < self.tareas_por_worker)]
+            if not libres:
+                return
+            en_uso = self._memoria_en_uso()
+            if en_uso > 0:
+                disponible = _memoria_disponible()
+                if en_uso + trabajo['memoria'] > self.memoria_max:
+                    return
+                if disponible is not None and trabajo['memoria'] > disponible:
+                    return
+            w = libres[0]
+            try:
+                w['tareas'].send((trabajo['id'], trabajo['tipo'], trabajo['args'], trabajo['ruta']))
+            except OSError:
+                # El proceso murió tras la revisión; _revisar_workers lo reemplaza y el trabajo sigue primero
+                return
+            self._cola.popleft()
+            w['trabajo'] = trabajo['id']
+            w['hechas'] += 1
+            trabajo['args'] = None
+            trabajo['estado'] = 'ejecutando'
+            trabajo['mensaje'] = 'Iniciando'
+            trabajo['iniciado'] = time.time()
+
+    def _finalizar(self, trabajo, estado):
+        trabajo['estado'] = estado
+        trabajo['args'] = None
+        trabajo['terminado'] = time.time()
+        self._borrar_archivo(trabajo['entrada'])
+        if estado != 'terminado':
+            self._borrar_resultado(trabajo)
+
+    def _borrar_resultado(self, trabajo):
+        self._borrar_archivo(trabajo['entrada'])
+        self._borrar_archivo(trabajo['ruta'])
+
+    def _borrar_archivo(self, ruta):
+        if ruta is None:
+            return
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+    def _purgar(self):
+        limite = time.time() - self.retener_segundos
+        for id_trabajo in [k for k, t in self._trabajos.items() if t['terminado'] and t['terminado'] < limite]:
+            self._borrar_resultado(self._trabajos.pop(id_trabajo))
+        # Sesiones que dejaron de avisar (pestaña cerrada): su memoria vuelve al presupuesto
+        for id_sesion in [k for k, v in self._sesiones.items() if v['visto'] < limite]:
+            del self._sesiones[id_sesion]
+
+
+def servicio_desde_entorno():
+    """
+    Crea el servicio con la configuración de variables de entorno:
+    CEREBRITO_WORKERS, CEREBRITO_MEMORIA_MB, CEREBRITO_MEMORIA_SESION_MB, CEREBRITO_COLA y, si se define
+    CEREBRITO_API_PUERTO, levanta también la API HTTP (CEREBRITO_API_HOST, por defecto 127.0.0.1;
+    fuera de loopback exige CEREBRITO_API_TOKEN).
+    """
+    memoria_mb = os.environ.get('CEREBRITO_MEMORIA_MB')
+    memoria_sesion_mb = os.environ.get('CEREBRITO_MEMORIA_SESION_MB')
+    servicio = ServicioTrabajos(
+        max_workers=int(os.environ.get('CEREBRITO_WORKERS', 2)),
+        memoria_max=int(memoria_mb) * 2**20 if memoria_mb else None,
+        max_en_cola=int(os.environ.get('CEREBRITO_COLA', 20)),
+        memoria_sesion_max=int(memoria_sesion_mb) * 2**20 if memoria_sesion_mb else None,
+    )
+    puerto = os.environ.get('CEREBRITO_API_PUERTO')
+    if puerto:
+        iniciar_api(servicio, os.environ.get('CEREBRITO_API_HOST', '127.0.0.1'), int(puerto),
+                    token=os.environ.get('CEREBRITO_API_TOKEN') or None)
+    return servicio
+
+# ---------------- API HTTP ----------------
+
+def _columna(valor):
+    # Con header=None las columnas son enteros
+    if valor is None:
+        return None
+    return int(valor) if valor.lstrip('-').isdigit() else valor
+
+
+def _es_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# Cuerpo JSON máximo para POST /trabajos/pdf
+MAX_CUERPO_JSON = 2**20
+
+
+class _ManejadorAPI(BaseHTTPRequestHandler):
+    servicio = None
+    token = None
+
+    def _responder(self, codigo, cuerpo=None, tipo='application/json', extra=None):
+        datos = cuerpo if isinstance(cuerpo, bytes) else json.dumps(cuerpo, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(datos)))
+        for k, v in (extra or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _ruta(self):
+        url = urlparse(self.path)
+        partes = [p for p in url.path.split('/') if p]
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        return partes, params
+
+    def _rechazar(self, codigo, mensaje, extra=None):
+        # Respuesta antes de leer el cuerpo: la conexión se cierra para no quedar con bytes sin consumir
+        self.close_connection = True
+        return self._responder(codigo, {'error': mensaje}, extra=extra)
+
+    def _autorizado(self):
+        if self.token is None:
+            return True
+        enviado = self.headers.get('Authorization', '')
+        if hmac.compare_digest(enviado.encode('utf-8'), f'Bearer {self.token}'.encode('utf-8')):
+            return True
+        self._rechazar(401, 'Token inválido o ausente.', extra={'WWW-Authenticate': 'Bearer'})
+        return False
+
+    def _largo_cuerpo(self):
+        # Content-Length o None si falta o no es válido
+        try:
+            largo = int(self.headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            return None
+        return largo if largo >= 0 else None
+
+    def _trabajo_api(self, id_trabajo):
+        # Solo los trabajos enviados por la API son visibles por HTTP (no los de las sesiones de la UI)
+        info = self.servicio.estado(id_trabajo)
+        return info if info is not None and info['origen'] == 'api' else None
+
+    def do_POST(self):
+        if not self._autorizado():
+            return
+        partes, params = self._ruta()
+        if partes not in (['trabajos', 'analisis'], ['trabajos', 'pdf']):
+            return self._rechazar(404, 'Ruta no encontrada.')
+        largo = self._largo_cuerpo()
+        if largo is None:
+            return self._rechazar(411, 'Falta Content-Length.')
+        try:
+            if partes == ['trabajos', 'analisis']:
+                if 'col_ent' not in params or 'col_sal' not in params:
+                    return self._rechazar(400, 'Faltan col_ent y col_sal.')
+                nombre = params.get('nombre', 'archivo.csv')
+                config = {k: _columna(params.get(k)) for k in ('col_ent', 'col_sal', 'col_fecha', 'col_hora', 'col_lat', 'col_lon')}
+                config['fila'] = int(params.get('fila', 1))
+                config['use_geo'] = config['col_lat'] is not None and config['col_lon'] is not None
+                # Se decide con Content-Length antes de leer el cuerpo; luego se copia a disco por bloques
+                self.servicio.validar_analisis(largo, nombre)
+                # El resumen JSON se arma en el worker: el servidor no carga el segmento completo
+                id_trabajo = self.servicio.enviar_analisis(self.rfile, nombre, config, resumen=True, origen='api',
+                                                           n_bytes=largo)
+            else:
+                if largo > MAX_CUERPO_JSON:
+                    return self._rechazar(413, f'El cuerpo JSON excede {MAX_CUERPO_JSON // 2**10} KB.')
+                datos = json.loads(self.rfile.read(largo) or b'{}')
+                id_trabajo = self.servicio.enviar_pdf(datos.get('top_ent', []), datos.get('top_sal', []),
+                                                      datos.get('coords_ent', {}), datos.get('coords_sal', {}), datos.get('filtro'),
+                                                      origen='api')
+        except TrabajoDemasiadoGrande as e:
+            return self._rechazar(413, str(e))
+        except TrabajoRechazado as e:
+            return self._rechazar(503, str(e), extra={'Retry-After': '30'})
+        except ValueError as e:
+            return self._rechazar(400, str(e))
+        self._responder(202, self.servicio.estado(id_trabajo))
+
+    def do_GET(self):
+        if not self._autorizado():
+            return
+        partes, _ = self._ruta()
+        if partes == ['trabajos']:
+            return self._responder(200, self.servicio.listar(origen='api'))
+        if len(partes) not in (2, 3) or partes[0] != 'trabajos' or (len(partes) == 3 and partes[2] != 'resultado'):
+            return self._responder(404, {'error': 'Ruta no encontrada.'})
+        info = self._trabajo_api(partes[1])
+        if info is None:
+            return self._responder(404, {'error': 'Trabajo no encontrado.'})
+        if len(partes) == 2:
+            return self._responder(200, info)
+        if info['estado'] != 'terminado':
+            return self._responder(409, info)
+        resultado = self.servicio.resultado(partes[1])
+        if info['tipo'] == 'pdf':
+            return self._responder(200, resultado, tipo='application/pdf')
+        self._responder(200, resultado)
+
+    def do_DELETE(self):
+        if not self._autorizado():
+            return
+        partes, _ = self._ruta()
+        if len(partes) != 2 or partes[0] != 'trabajos':
+            return self._responder(404, {'error': 'Ruta no encontrada.'})
+        if self._trabajo_api(partes[1]) is None or not self.servicio.descartar(partes[1]):
+            return self._responder(404, {'error': 'Trabajo no encontrado.'})
+        self._responder(200, {'id': partes[1], 'descartado': True})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def crear_api(servicio, host='127.0.0.1', puerto=8765, token=None):
+    """
+    Crea el servidor HTTP de la API. Con `token`, cada pedido debe enviar `Authorization: Bearer <token>`;
+    es obligatorio si `host` no es de loopback.
+    """
+    if token is None and not _es_loopback(host):
+        raise ValueError(f'La API en {host} (fuera de loopback) requiere un token (CEREBRITO_API_TOKEN o --token).')
+    manejador = type('ManejadorAPI', (_ManejadorAPI,), {'servicio': servicio, 'token': token})
+    return ThreadingHTTPServer((host, puerto), manejador)
+
+
+def iniciar_api(servicio, host='127.0.0.1', puerto=8765, token=None):
+    """Levanta la API HTTP en un hilo de fondo y retorna el servidor."""
+    servidor = crear_api(servicio, host, puerto, token)
+    threading.Thread(target=servidor.serve_forever, name='cerebrito-api', daemon=True).start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servicio local de trabajos de Cerebrito (análisis y PDF).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--memoria-mb', type=int, default=None, help='Presupuesto de memoria para trabajos en ejecución')
+    parser.add_argument('--cola', type=int, default=20, help='Máximo de trabajos en espera')
+    parser.add_argument('--token', default=os.environ.get('CEREBRITO_API_TOKEN') or None,
+                        help='Token Bearer exigido a cada pedido (obligatorio fuera de loopback)')
+    args = parser.parse_args()
+
+    servicio = ServicioTrabajos(max_workers=args.workers,
+                                memoria_max=args.memoria_mb * 2**20 if args.memoria_mb else None,
+                                max_en_cola=args.cola)
+    try:
+        servidor = crear_api(servicio, args.host, args.puerto, args.token)
+    except ValueError as e:
+        servicio.cerrar()
+        parser.error(str(e))
+    print(f'Cerebrito - servicio de trabajos en http://{args.host}:{args.puerto} '
+          f'({args.workers} procesos, {servicio.memoria_max // 2**20} MB)')
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servicio.cerrar()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cerebrito_core import (
+    analizar_segmento, nuevo_analisis, fusionar_segmento, obtener_indice_temporal, filtrar_por_tiempo,
+    obtener_detalle_numero, posiciones_numero, numeros_en, generar_pdf_full,
+)
+
+CLAVES_RESUMEN = ('top_ent', 'top_sal', 'coords_ent', 'coords_sal', 'dia_ent', 'dia_sal', 'n_filas')
+
+
+def _llamadas(n, semilla, distintos=60):
+    r = np.random.default_rng(semilla)
+    ts = pd.Timestamp('2024-01-01') + pd.to_timedelta(r.integers(0, 20 * 86400, n), 's')
+    return pd.DataFrame({
+        0: [f'55{x:08d}' for x in r.integers(0, distintos, n)],
+        1: [f'55{x:08d}' for x in r.integers(0, distintos, n)],
+        2: ts.strftime('%Y-%m-%d %H:%M:%S'),
+        3: r.choice([19.1, 19.2, 19.3], n),
+        4: r.choice([-99.1, -99.2], n),
+    })
+
+
+def _analisis(*dfs):
+    estado = nuevo_analisis({'use_geo': True})
+    for i, df in enumerate(dfs):
+        fusionar_segmento(estado, analizar_segmento(df, 0, 1, 2, None, 3, 4, nombre=f'f{i}.csv'), huella=f'h{i}')
+    return estado
+
+
+def test_fusionar_dos_segmentos_igual_a_una_pasada():
+    a, b = _llamadas(3000, 1), _llamadas(2000, 2)
+    por_partes = _analisis(a, b)
+    de_una = _analisis(pd.concat([a, b], ignore_index=True))
+    for clave in CLAVES_RESUMEN:
+        assert por_partes[clave] == de_una[clave], clave
+    numero = por_partes['top_ent'][0][0]
+    assert dict(obtener_detalle_numero(por_partes, numero)['contrapartes']) == dict(obtener_detalle_numero(de_una, numero)['contrapartes'])
+
+
+def test_fusionar_rechaza_contenido_repetido():
+    df = _llamadas(100, 3)
+    estado = _analisis(df)
+    with pytest.raises(ValueError):
+        fusionar_segmento(estado, analizar_segmento(df, 0, 1, 2), huella='h0')
+    assert estado['n_filas'] == 100
+
+
+def test_indice_numeros_posiciones():
+    df = _llamadas(500, 4)
+    df.loc[::7, 0] = 'no es número'
+    segmento = analizar_segmento(df, 0, 1, 2)
+    indice = segmento['indice_ent']
+    nums = numeros_en(indice)
+    for numero in set(x for x in nums if x is not None):
+        assert sorted(posiciones_numero(indice, numero)) == [i for i, x in enumerate(nums) if x == numero]
+    assert len(posiciones_numero(indice, '5599999999')) == 0
+
+
+def _brute_force(df, desde, hasta, hora_desde, hora_hasta):
+    ts = pd.to_datetime(df[2])
+    mascara = pd.Series(True, index=df.index)
+    if desde is not None:
+        mascara &= (ts.dt.normalize() >= desde) & (ts.dt.normalize() <= hasta)
+    h = ts.dt.hour
+    if hora_desde <= hora_hasta:
+        mascara &= (h >= hora_desde) & (h <= hora_hasta)
+    else:
+        mascara &= (h >= hora_desde) | (h <= hora_hasta)
+    return df[mascara]
+
+
+def _coords_brute_force(filtrado, col, top):
+    coords = {}
+    for num, _ in top:
+        filas = filtrado[filtrado[col] == num]
+        veces = filas.groupby([3, 4]).size()
+        # Empates: la menor lat/lon
+        lat, lon = veces[veces == veces.max()].index.min()
+        coords[num] = {'lat': lat, 'lon': lon, 'count': int(veces.max())}
+    return coords
+
+
+@pytest.mark.parametrize('desde, hasta, hora_desde, hora_hasta', [
+    ('2024-01-03', '2024-01-09', 0, 23),
+    ('2024-01-02', '2024-01-15', 22, 5),
+    (None, None, 8, 17),
+    (None, None, 23, 1),
+    ('2024-01-05', '2024-01-05', 12, 12),
+])
+def test_filtrar_por_tiempo_igual_a_recalculo(desde, hasta, hora_desde, hora_hasta):
+    a, b = _llamadas(4000, 5), _llamadas(3000, 6)
+    estado = _analisis(a, b)
+    filtrado = _brute_force(pd.concat([a, b], ignore_index=True), desde, hasta, hora_desde, hora_hasta)
+    res = filtrar_por_tiempo(obtener_indice_temporal(estado), desde, hasta, hora_desde, hora_hasta)
+    assert res['n_llamadas'] == len(filtrado)
+    for rol, col in (('ent', 0), ('sal', 1)):
+        esperado = Counter(filtrado[col]).most_common(10)
+        assert res[f'top_{rol}'] == esperado
+        assert res[f'coords_{rol}'] == _coords_brute_force(filtrado, col, esperado)
+
+
+def test_filtrar_rango_completo_igual_al_resumen():
+    estado = _analisis(_llamadas(3000, 7), _llamadas(2000, 8))
+    res = filtrar_por_tiempo(obtener_indice_temporal(estado))
+    for clave in ('top_ent', 'top_sal', 'coords_ent', 'coords_sal'):
+        assert res[clave] == estado[clave], clave
+
+
+def test_indice_temporal_extendido_igual_a_reconstruido():
+    a, b, c = _llamadas(3000, 9), _llamadas(2000, 10, distintos=90), _llamadas(1000, 11)
+    # Timestamps repetidos entre archivos: el orden debe ser el de un ordenamiento estable de todo
+    b[2] = a[2][:2000].to_numpy()
+    estado = _analisis(a)
+    obtener_indice_temporal(estado)
+    for i, df in enumerate((b, c), start=1):
+        fusionar_segmento(estado, analizar_segmento(df, 0, 1, 2, None, 3, 4, nombre=f'f{i}.csv'), huella=f'h{i}')
+    extendido = estado['indice_temporal']
+    estado['indice_temporal'] = None
+    reconstruido = obtener_indice_temporal(estado)
+    for clave, valores in reconstruido.items():
+        assert np.array_equal(extendido[clave], valores), clave
+    todo = pd.concat([a, b, c], ignore_index=True)
+    ts = pd.to_datetime(todo[2]).to_numpy()
+    assert np.array_equal(extendido['fila'], np.argsort(ts, kind='stable'))
+    assert np.array_equal(extendido['catalogo'][extendido['cod_ent']], todo[0].to_numpy()[extendido['fila']])
+
+
+def test_pdf_indica_el_filtro():
+    PyPDF2 = pytest.importorskip('PyPDF2')
+    filtro = {'desde': '2024-01-02', 'hasta': '2024-01-05', 'hora_desde': 22, 'hora_hasta': 5, 'n_llamadas': 123}
+    pdf = generar_pdf_full([('5500000001', 3)], [('5500000002', 2)], {}, {}, filtro=filtro)
+    texto = PyPDF2.PdfReader(pdf).pages[0].extract_text()
+    assert '02/01/2024 a 05/01/2024, de 22:00 a 05:59' in texto
+    assert '123 llamadas' in texto
@@ -0,0 +1,206 @@
+import http.client
+import json
+import os
+import signal
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from cerebrito_jobs import ServicioTrabajos, TrabajoRechazado, TrabajoDemasiadoGrande, crear_api, estimar_memoria_analisis
+
+CONFIG = {'col_ent': 0, 'col_sal': 1, 'col_fecha': 2, 'use_geo': False}
+
+
+def _csv(filas, semilla=0):
+    r = np.random.default_rng(semilla)
+    lineas = [f'55{a:08d},55{b:08d},2024-01-{d:02d} 10:00:00'
+              for a, b, d in zip(r.integers(0, 1000, filas), r.integers(0, 1000, filas), r.integers(1, 28, filas))]
+    return ('\n'.join(lineas) + '\n').encode('utf-8')
+
+
+@pytest.fixture(scope='module')
+def csv_chico():
+    return _csv(50)
+
+
+@pytest.fixture(scope='module')
+def csv_grande():
+    # Lo bastante grande para que el trabajo siga en ejecución mientras el test actúa sobre él
+    return _csv(400_000, 1)
+
+
+@pytest.fixture
+def servicio():
+    servicio = ServicioTrabajos(max_workers=1, memoria_max=2 * 1024 ** 3)
+    yield servicio
+    servicio.cerrar()
+
+
+def _esperar_estado(servicio, id_trabajo, estado, timeout=60):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        info = servicio.estado(id_trabajo)
+        if info['estado'] == estado:
+            return info
+        time.sleep(0.05)
+    raise AssertionError(f'{id_trabajo} no llegó a {estado}: {servicio.estado(id_trabajo)}')
+
+
+def test_cola_fifo(servicio, csv_chico):
+    ids = [servicio.enviar_analisis(csv_chico, f'{i}.csv', CONFIG) for i in range(3)]
+    en_cola = [servicio.estado(i) for i in ids if servicio.estado(i)['estado'] == 'en_cola']
+    assert [info['posicion'] for info in en_cola] == list(range(1, len(en_cola) + 1))
+    finales = [servicio.esperar(i, timeout=60) for i in ids]
+    assert [info['estado'] for info in finales] == ['terminado'] * 3
+    assert [info['iniciado'] for info in finales] == sorted(info['iniciado'] for info in finales)
+    resultado = servicio.resultado(ids[0])
+    assert len(resultado['segmento']['df']) == 50
+    assert finales[0]['memoria_resultado'] > 0
+
+
+def test_rechazos(csv_chico, csv_grande):
+    memoria = estimar_memoria_analisis(len(csv_grande), 'a.csv')
+    servicio = ServicioTrabajos(max_workers=1, memoria_max=memoria, max_en_cola=1)
+    try:
+        with pytest.raises(TrabajoDemasiadoGrande):
+            servicio.validar_analisis(len(csv_grande) * 2, 'a.csv')
+        # Uno en ejecución y otro en espera: la cola está llena
+        largo = servicio.enviar_analisis(csv_grande, 'a.csv', CONFIG)
+        _esperar_estado(servicio, largo, 'ejecutando')
+        servicio.enviar_analisis(csv_chico, 'b.csv', CONFIG)
+        with pytest.raises(TrabajoRechazado) as e:
+            servicio.enviar_analisis(csv_chico, 'c.csv', CONFIG)
+        assert not isinstance(e.value, TrabajoDemasiadoGrande)
+        # El archivo del rechazado no queda en disco
+        assert len([f for f in os.listdir(servicio._dir) if f.endswith('.entrada')]) == 2
+    finally:
+        servicio.cerrar()
+
+
+def test_memoria_de_sesion_retiene_la_cola(csv_chico):
+    memoria = estimar_memoria_analisis(len(csv_chico), 'a.csv')
+    servicio = ServicioTrabajos(max_workers=1, memoria_max=memoria + 2**20, memoria_sesion_max=2 * 2**20)
+    try:
+        with pytest.raises(TrabajoDemasiadoGrande):
+            servicio.reservar_sesion('s1', 3 * 2**20)
+        servicio.reservar_sesion('s1', 2 * 2**20)
+        id_trabajo = servicio.enviar_analisis(csv_chico, 'a.csv', CONFIG)
+        assert servicio.esperar(id_trabajo, timeout=3)['estado'] == 'en_cola'
+        servicio.liberar_sesion('s1')
+        assert servicio.esperar(id_trabajo, timeout=60)['estado'] == 'terminado'
+    finally:
+        servicio.cerrar()
+
+
+def test_cancelar_en_cola_y_en_ejecucion(servicio, csv_chico, csv_grande):
+    largo = servicio.enviar_analisis(csv_grande, 'grande.csv', CONFIG)
+    chico = servicio.enviar_analisis(csv_chico, 'chico.csv', CONFIG)
+    assert servicio.cancelar(chico)
+    assert servicio.estado(chico)['estado'] == 'cancelado'
+    _esperar_estado(servicio, largo, 'ejecutando')
+    # El servicio sigue el RSS real del worker
+    limite = time.monotonic() + 5
+    while not servicio.estado(largo)['rss'] and time.monotonic() < limite:
+        time.sleep(0.05)
+    assert servicio.estado(largo)['rss'] > 0
+    proceso = [w['proceso'] for w in servicio._workers if w['trabajo'] == largo][0]
+    assert servicio.cancelar(largo)
+    assert servicio.estado(largo)['estado'] == 'cancelado'
+    proceso.join(timeout=10)
+    assert not proceso.is_alive()
+    assert not servicio.cancelar(largo)
+    # El pool se repone y sigue atendiendo
+    otro = servicio.enviar_analisis(csv_chico, 'otro.csv', CONFIG)
+    assert servicio.esperar(otro, timeout=60)['estado'] == 'terminado'
+
+
+def test_caida_de_worker(servicio, csv_chico, csv_grande):
+    id_trabajo = servicio.enviar_analisis(csv_grande, 'grande.csv', CONFIG)
+    _esperar_estado(servicio, id_trabajo, 'ejecutando')
+    pid = [w['proceso'].pid for w in servicio._workers if w['trabajo'] == id_trabajo][0]
+    os.kill(pid, signal.SIGKILL)
+    info = servicio.esperar(id_trabajo, timeout=30)
+    assert info['estado'] == 'error'
+    otro = servicio.enviar_analisis(csv_chico, 'otro.csv', CONFIG)
+    assert servicio.esperar(otro, timeout=60)['estado'] == 'terminado'
+
+
+def test_purga(csv_chico):
+    servicio = ServicioTrabajos(max_workers=1, memoria_max=2 * 1024 ** 3, retener_segundos=0)
+    try:
+        servicio.reservar_sesion('s1', 2**20)
+        id_trabajo = servicio.enviar_analisis(csv_chico, 'a.csv', CONFIG)
+        servicio.esperar(id_trabajo, timeout=60)
+        limite = time.monotonic() + 5
+        while servicio.estado(id_trabajo) is not None and time.monotonic() < limite:
+            time.sleep(0.1)
+        assert servicio.estado(id_trabajo) is None
+        assert os.listdir(servicio._dir) == []
+        assert servicio._sesiones == {}
+    finally:
+        servicio.cerrar()
+
+# ---------------- API HTTP ----------------
+
+@pytest.fixture
+def api(servicio):
+    servidor = crear_api(servicio, '127.0.0.1', 0, token='secreto')
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def _pedido(servidor, metodo, ruta, cuerpo=None, token='secreto', cabeceras=None):
+    conexion = http.client.HTTPConnection('127.0.0.1', servidor.server_address[1], timeout=30)
+    conexion.putrequest(metodo, ruta)
+    if token:
+        conexion.putheader('Authorization', f'Bearer {token}')
+    for k, v in (cabeceras or {}).items():
+        conexion.putheader(k, v)
+    if cuerpo is not None:
+        conexion.putheader('Content-Length', str(len(cuerpo)))
+    conexion.endheaders(cuerpo)
+    respuesta = conexion.getresponse()
+    datos = respuesta.read()
+    conexion.close()
+    return respuesta.status, datos
+
+
+def test_api_token_obligatorio_fuera_de_loopback(servicio):
+    with pytest.raises(ValueError):
+        crear_api(servicio, '0.0.0.0', 0)
+
+
+def test_api_errores(api, servicio, csv_chico):
+    assert _pedido(api, 'GET', '/trabajos', token=None)[0] == 401
+    assert _pedido(api, 'GET', '/trabajos', token='otro')[0] == 401
+    assert _pedido(api, 'POST', '/trabajos/analisis?col_ent=0&col_sal=1')[0] == 411
+    # Se rechaza por Content-Length sin leer (ni enviar) el cuerpo
+    estado, _ = _pedido(api, 'POST', '/trabajos/analisis?col_ent=0&col_sal=1&nombre=a.csv',
+                        cabeceras={'Content-Length': str(servicio.memoria_max)})
+    assert estado == 413
+    estado, _ = _pedido(api, 'POST', '/trabajos/pdf', cabeceras={'Content-Length': str(10 * 2**20)})
+    assert estado == 413
+    # Los trabajos de la UI no son visibles por HTTP
+    id_ui = servicio.enviar_analisis(csv_chico, 'a.csv', CONFIG)
+    assert _pedido(api, 'GET', f'/trabajos/{id_ui}')[0] == 404
+    assert _pedido(api, 'GET', f'/trabajos/{id_ui}/resultado')[0] == 404
+    assert _pedido(api, 'DELETE', f'/trabajos/{id_ui}')[0] == 404
+    assert json.loads(_pedido(api, 'GET', '/trabajos')[1]) == []
+    assert servicio.estado(id_ui) is not None
+
+
+def test_api_analisis(api, servicio, csv_chico):
+    estado, datos = _pedido(api, 'POST', '/trabajos/analisis?col_ent=0&col_sal=1&col_fecha=2&nombre=a.csv', csv_chico)
+    assert estado == 202
+    id_trabajo = json.loads(datos)['id']
+    assert servicio.esperar(id_trabajo, timeout=60)['estado'] == 'terminado'
+    estado, datos = _pedido(api, 'GET', f'/trabajos/{id_trabajo}/resultado')
+    assert estado == 200
+    assert json.loads(datos)['n_filas'] == 50
+    assert [t['id'] for t in json.loads(_pedido(api, 'GET', '/trabajos')[1])] == [id_trabajo]
+    assert _pedido(api, 'DELETE', f'/trabajos/{id_trabajo}')[0] == 200
+    assert servicio.estado(id_trabajo) is None